@@ -0,0 +1,81 @@
+# cache.py
+import os
+import hashlib
+import logging
+from cachetools import TTLCache
+from dotenv import load_dotenv
+from fastapi import Request
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+from .responses import dumps
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+PRICE_CACHE_SIZE = int(os.getenv("PRICE_CACHE_SIZE", "10000"))
+PRICE_CACHE_TTL = int(os.getenv("PRICE_CACHE_TTL", "300"))
+# Product list cache; disabled unless REDIS_URL is set
+REDIS_URL = os.getenv("REDIS_URL")
+LIST_CACHE_TTL = int(os.getenv("LIST_CACHE_TTL", "30"))
+# Seconds; redis-py waits forever by default, so a stalled server would
+# hang every request that touches the cache
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "0.2"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.2"))
+
+# Bumped on every product write; cached pages from older versions are stale
+PRODUCTS_VERSION_KEY = "products:version"
+
+# Product prices are read on every order but never change through this API,
+# so a bounded per-process cache with a short TTL absorbs repeat lookups
+price_cache = TTLCache(maxsize=PRICE_CACHE_SIZE, ttl=PRICE_CACHE_TTL)
+
+def connect_redis():
+    """Create the Redis client, or None when caching is not configured"""
+    if not REDIS_URL:
+        return None
+    return aioredis.from_url(
+        REDIS_URL,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT
+    )
+
+async def get_redis(request: Request):
+    """Dependency to get the Redis client bound to the app at startup"""
+    return request.app.state.redis
+
+def list_cache_key(*params):
+    """Cache key for one products page, derived from its query parameters"""
+    digest = hashlib.blake2b(dumps(params), digest_size=16).hexdigest()
+    return f"products:list:{digest}"
+
+async def get_cached_page(redis, key):
+    """Return (version, body) for a page; body is None on a miss or stale entry"""
+    try:
+        # Version and page in one round-trip
+        version, cached = await redis.mget(PRODUCTS_VERSION_KEY, key)
+    except RedisError as e:
+        logger.warning("Product list cache read failed: %s", e)
+        return None, None
+    
+    version = version or b"0"
+    if cached:
+        cached_version, _, body = cached.partition(b"|")
+        if cached_version == version:
+            return version, body
+    return version, None
+
+async def set_cached_page(redis, key, version, body):
+    """Store a rendered page tagged with the version it was read under"""
+    try:
+        await redis.setex(key, LIST_CACHE_TTL, version + b"|" + body)
+    except RedisError as e:
+        logger.warning("Product list cache write failed: %s", e)
+
+async def invalidate_product_lists(redis):
+    """Make every cached products page stale"""
+    try:
+        await redis.incr(PRODUCTS_VERSION_KEY)
+    except RedisError as e:
+        logger.warning("Product list cache invalidation failed: %s", e)
@@ -1,12 +1,122 @@
 # main.py
-from fastapi import FastAPI, HTTPException, Query, Depends
-from typing import Optional
-from datetime import datetime
-from bson import ObjectId
-from .models import CreateOrderRequest,CreateProductRequest
-from .database import get_database, serialize_doc
+import re
+import base64
+import asyncio
+from fastapi import FastAPI, HTTPException, Query, Depends, Body, Request
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+from datetime import datetime, timezone
+from functools import lru_cache
+from bson import Regex
+from pymongo.errors import BulkWriteError, ExecutionTimeout, WaitQueueTimeoutError
+from .models import CreateOrderRequest,CreateProductRequest,PyObjectId
+from .database import connect, get_database, get_collections, create_indexes, warm_pool, Collections, DATABASE_NAME, QUERY_MAX_TIME_MS
+from .responses import MongoJSONResponse, dumps, conditional_response
+from .cache import (
+    price_cache, connect_redis, get_redis, list_cache_key,
+    get_cached_page, set_cached_page, invalidate_product_lists
+)
 
-app = FastAPI(title="E-commerce API", version="1.0.0")
+# Fields returned by the list endpoints; anything else stored on a
+# document stays on the server
+PRODUCT_PROJECTION = {"name": 1, "price": 1, "size": 1, "description": 1, "created_at": 1}
+ORDER_PROJECTION = {"user_id": 1, "items": 1, "total_amount": 1, "created_at": 1}
+
+def _utcnow():
+    """Current UTC time at the millisecond precision BSON stores"""
+    # Truncated so the document echoed on insert matches what later reads
+    # return; timezone-aware, as datetime.utcnow() is deprecated
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+async def _resolve_prices(collections, oids):
+    """Map product ids to prices, serving from the price cache where possible"""
+    prices = {}
+    misses = []
+    for oid in oids:
+        price = price_cache.get(oid)
+        if price is None:
+            misses.append(oid)
+        else:
+            prices[oid] = price
+    
+    if misses:
+        # Resolve every uncached product in one round-trip
+        cursor = collections.products.find({"_id": {"$in": misses}}, {"price": 1}).max_time_ms(QUERY_MAX_TIME_MS)
+        async for p in cursor:
+            prices[p["_id"]] = price_cache[p["_id"]] = p["price"]
+    
+    return prices
+
+@lru_cache(maxsize=1024)
+def _name_pattern(name):
+    """Case-insensitive substring regex for a product-name filter"""
+    # Escaped so user input matches literally; cached because storefront
+    # searches repeat the same few terms
+    return Regex(re.escape(name), "i")
+
+def _ndjson_response(cursor, limit, encode_cursor):
+    """Stream up to limit documents as newline-delimited JSON, one per line"""
+    # The stream ends in a {"next_cursor": ...} line, null on the last page;
+    # one extra document tells whether another page exists
+    cursor = cursor.limit(limit + 1)
+    
+    async def body():
+        last = None
+        sent = 0
+        async for doc in cursor:
+            if sent == limit:
+                yield dumps({"next_cursor": encode_cursor(last)}) + b"\n"
+                return
+            yield dumps(doc) + b"\n"
+            last = doc
+            sent += 1
+        yield dumps({"next_cursor": None}) + b"\n"
+    
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+def _encode_product_cursor(product):
+    """Products cursor: the _id that after= seeks past"""
+    return str(product["_id"])
+
+def _encode_order_cursor(order):
+    """Opaque orders cursor: base64 of '<created_at ISO>|<_id>'"""
+    raw = f"{order['created_at'].isoformat()}|{order['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_order_cursor(token):
+    """Inverse of _encode_order_cursor; 400 on anything malformed"""
+    try:
+        created_at, _, oid = base64.urlsafe_b64decode(token.encode()).decode().partition("|")
+        return datetime.fromisoformat(created_at), PyObjectId.validate(oid)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One client, and so one connection pool, for the life of the process
+    app.state.client = connect()
+    app.state.db = app.state.client[DATABASE_NAME]
+    app.state.collections = Collections(app.state.db)
+    app.state.redis = connect_redis()
+    # Warm the pool and build indexes in the background so the app serves
+    # traffic right away
+    app.state.warmup_task = asyncio.create_task(warm_pool(app.state.db))
+    app.state.index_task = asyncio.create_task(create_indexes(app.state.db))
+    yield
+    app.state.warmup_task.cancel()
+    app.state.index_task.cancel()
+    app.state.client.close()
+    if app.state.redis is not None:
+        await app.state.redis.aclose()
+
+app = FastAPI(
+    title="E-commerce API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=MongoJSONResponse
+)
 
 # Routes
 @app.get("/")
@@ -14,122 +124,292 @@ async def root():
     return {"message": "E-commerce API", "status": "running"}
 
 @app.get("/health")
-async def health():
+async def health(db=Depends(get_database)):
+    index_task = app.state.index_task
+    if not index_task.done():
+        indexes = "building"
+    else:
+        indexes = "ready" if index_task.result() else "failed"
     try:
-        db = await get_database()
         await db.command('ping')
-        return {"status": "healthy", "database": "connected"}
+        return {"status": "healthy", "database": "connected", "indexes": indexes}
     except Exception:
-        return {"status": "healthy", "database": "disconnected"}
+        return {"status": "healthy", "database": "disconnected", "indexes": indexes}
 
 @app.post("/products", status_code=201)
-async def create_product(product: CreateProductRequest, db=Depends(get_database)):
+async def create_product(
+    product: CreateProductRequest,
+    collections=Depends(get_collections),
+    redis=Depends(get_redis)
+):
     try:
         product_doc = {
             "name": product.name,
             "price": product.price,
             "size": product.size,
             "description": product.description,
-            "created_at": datetime.utcnow()
+            "created_at": _utcnow()
         }
         
-        result = await db.products.insert_one(product_doc)
-        created_product = await db.products.find_one({"_id": result.inserted_id})
+        result = await collections.products.insert_one(product_doc)
+        product_doc["_id"] = result.inserted_id
+        
+        if redis is not None:
+            await invalidate_product_lists(redis)
         
-        return serialize_doc(created_product)
+        return MongoJSONResponse(product_doc, status_code=201)
+    except WaitQueueTimeoutError:
+        raise HTTPException(status_code=503, detail="Query timed out, please retry")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/products")
 async def list_products(
+    request: Request,
     name: Optional[str] = Query(None),
     size: Optional[str] = Query(None),
     limit: int = Query(10, ge=1, le=100),
     offset: int = Query(0, ge=0),
-    db=Depends(get_database)
+    after: Optional[PyObjectId] = Query(None),
+    response_format: Literal["json", "ndjson"] = Query("json", alias="format"),
+    include_total: bool = Query(True),
+    collections=Depends(get_collections),
+    redis=Depends(get_redis)
 ):
     try:
         filter_query = {}
         
-        if name:
-            filter_query["name"] = {"$regex": name, "$options": "i"}
-        if size:
+        # Blank filters are dropped so the query stays a plain _id scan
+        if name and (name := name.strip()):
+            filter_query["name"] = _name_pattern(name)
+        if size and (size := size.strip()):
             filter_query["size"] = size
         
-        total_count = await db.products.count_documents(filter_query)
+        # Serve repeated JSON pages from Redis when caching is configured
+        cache_key = None
+        if redis is not None and response_format == "json":
+            cache_key = list_cache_key(name, size, limit, offset, after, include_total)
+            version, body = await get_cached_page(redis, cache_key)
+            if body is not None:
+                return conditional_response(request, body)
+            if version is None:
+                # Redis is unreachable; don't attempt the write-back either
+                cache_key = None
+        
+        # Keyset pagination: seek past the cursor instead of skipping
+        page_query = filter_query
+        skip = offset
+        if after:
+            page_query = {**filter_query, "_id": {"$gt": after}}
+            skip = 0
+        
+        cursor = (
+            collections.products.find(page_query, PRODUCT_PROJECTION)
+            .sort("_id", 1)
+            .skip(skip)
+            .max_time_ms(QUERY_MAX_TIME_MS)
+        )
+        if response_format == "ndjson":
+            # Streamed as the cursor yields and without a count; the last
+            # line carries the next_cursor for after=
+            return _ndjson_response(cursor, limit, _encode_product_cursor)
         
-        cursor = db.products.find(filter_query).skip(offset).limit(limit)
-        products = await cursor.to_list(length=limit)
+        # Fetch one extra document to learn whether another page exists
+        page = cursor.limit(limit + 1).to_list(length=limit + 1)
+        if not include_total:
+            # Clients paging on has_more skip the count query entirely
+            total_count, products = None, await page
+        elif filter_query:
+            total_count, products = await asyncio.gather(
+                collections.products.count_documents(filter_query, maxTimeMS=QUERY_MAX_TIME_MS),
+                page
+            )
+        else:
+            # Unfiltered totals come from collection metadata, not an index walk
+            total_count, products = await asyncio.gather(
+                collections.products.estimated_document_count(maxTimeMS=QUERY_MAX_TIME_MS),
+                page
+            )
         
-        return {
-            "products": [serialize_doc(p) for p in products],
+        has_more = len(products) > limit
+        products = products[:limit]
+        
+        body = dumps({
+            "products": products,
             "total": total_count,
             "limit": limit,
-            "offset": offset
-        }
+            "offset": offset,
+            "has_more": has_more,
+            "next_cursor": products[-1]["_id"] if has_more else None
+        })
+        if cache_key is not None:
+            await set_cached_page(redis, cache_key, version, body)
+        return conditional_response(request, body)
+    except HTTPException:
+        raise
+    except (ExecutionTimeout, WaitQueueTimeoutError):
+        raise HTTPException(status_code=503, detail="Query timed out, please retry")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _build_order_doc(order, prices, now, index=None):
+    """Price an order request into the document stored in db.orders"""
+    for item in order.items:
+        if item.product_id not in prices:
+            detail = f"Product {item.product_id} not found"
+            if index is not None:
+                # Batch callers need to know which order to fix
+                detail = f"Order {index}: {detail}"
+            raise HTTPException(status_code=404, detail=detail)
+    
+    return {
+        "user_id": order.user_id,
+        "items": [
+            {"product_id": str(item.product_id), "quantity": item.quantity}
+            for item in order.items
+        ],
+        "total_amount": sum(prices[item.product_id] * item.quantity for item in order.items),
+        "created_at": now
+    }
+
 @app.post("/orders", status_code=201)
-async def create_order(order: CreateOrderRequest, db=Depends(get_database)):
+async def create_order(order: CreateOrderRequest, collections=Depends(get_collections)):
     try:
-        total_amount = 0.0
-        order_items = []
-        
-        for item in order.items:
-            product = await db.products.find_one({"_id": ObjectId(item.product_id)})
-            if not product:
-                raise HTTPException(status_code=404, detail=f"Product {item.product_id} not found")
-            
-            item_total = product["price"] * item.quantity
-            total_amount += item_total
-            
-            order_items.append({
-                "product_id": item.product_id,
-                "quantity": item.quantity
-            })
-        
-        order_doc = {
-            "user_id": order.user_id,
-            "items": order_items,
-            "total_amount": total_amount,
-            "created_at": datetime.utcnow()
+        # product_id is already an ObjectId, parsed during validation
+        prices = await _resolve_prices(collections, [item.product_id for item in order.items])
+        order_doc = _build_order_doc(order, prices, _utcnow())
+        
+        result = await collections.orders.insert_one(order_doc)
+        order_doc["_id"] = result.inserted_id
+        
+        return MongoJSONResponse(order_doc, status_code=201)
+    except HTTPException:
+        raise
+    except (ExecutionTimeout, WaitQueueTimeoutError):
+        raise HTTPException(status_code=503, detail="Query timed out, please retry")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Partial-failure body of POST /orders/batch, for the OpenAPI schema
+BATCH_PARTIAL_RESPONSE = {
+    "description": "Some orders were written; retry only the failed indexes",
+    "content": {"application/json": {"schema": {
+        "type": "object",
+        "properties": {
+            "orders": {"type": "array", "items": {"type": "object"}},
+            "failed": {"type": "array", "items": {
+                "type": "object",
+                "properties": {
+                    "index": {"type": "integer"},
+                    "detail": {"type": "string"}
+                }
+            }}
         }
+    }}}
+}
+
+@app.post("/orders/batch", status_code=201, responses={207: BATCH_PARTIAL_RESPONSE})
+async def create_orders_batch(
+    orders: List[CreateOrderRequest] = Body(..., min_length=1, max_length=100),
+    collections=Depends(get_collections)
+):
+    try:
+        # One price lookup over the union of every order's products
+        oids = list({item.product_id for order in orders for item in order.items})
+        prices = await _resolve_prices(collections, oids)
         
-        result = await db.orders.insert_one(order_doc)
-        created_order = await db.orders.find_one({"_id": result.inserted_id})
+        now = _utcnow()
+        # An unknown product rejects the whole batch before anything is written
+        order_docs = [_build_order_doc(order, prices, now, i) for i, order in enumerate(orders)]
         
-        return serialize_doc(created_order)
+        # Unordered bulk insert lets the server apply the writes in parallel;
+        # insert_many sets each document's _id in place
+        await collections.orders.insert_many(order_docs, ordered=False)
+        
+        return MongoJSONResponse({"orders": order_docs}, status_code=201)
+    except BulkWriteError as e:
+        # The unordered insert still wrote every order without an error;
+        # report which went through so clients retry only the failures
+        errors = e.details["writeErrors"]
+        failed = {err["index"] for err in errors}
+        return MongoJSONResponse({
+            "orders": [doc for i, doc in enumerate(order_docs) if i not in failed],
+            "failed": [{"index": err["index"], "detail": err["errmsg"]} for err in errors]
+        }, status_code=207)
     except HTTPException:
         raise
+    except (ExecutionTimeout, WaitQueueTimeoutError):
+        raise HTTPException(status_code=503, detail="Query timed out, please retry")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/orders/{user_id}")
 async def get_user_orders(
+    request: Request,
     user_id: str,
     limit: int = Query(10, ge=1, le=100),
     offset: int = Query(0, ge=0),
-    db=Depends(get_database)
+    after: Optional[str] = Query(None),
+    response_format: Literal["json", "ndjson"] = Query("json", alias="format"),
+    include_total: bool = Query(True),
+    collections=Depends(get_collections)
 ):
     try:
         filter_query = {"user_id": user_id}
         
-        total_count = await db.orders.count_documents(filter_query)
+        # Keyset pagination, newest first: seek past the cursor's
+        # (created_at, _id) position instead of skipping
+        page_query = filter_query
+        skip = offset
+        if after:
+            created_at, oid = _decode_order_cursor(after)
+            page_query = {**filter_query, "$or": [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "_id": {"$lt": oid}}
+            ]}
+            skip = 0
+        
+        cursor = (
+            collections.orders.find(page_query, ORDER_PROJECTION)
+            .sort([("created_at", -1), ("_id", -1)])
+            .skip(skip)
+            .max_time_ms(QUERY_MAX_TIME_MS)
+        )
+        if response_format == "ndjson":
+            # Streamed as the cursor yields and without a count; the last
+            # line carries the opaque next_cursor for after=
+            return _ndjson_response(cursor, limit, _encode_order_cursor)
         
-        cursor = db.orders.find(filter_query).skip(offset).limit(limit)
-        orders = await cursor.to_list(length=limit)
+        # Fetch one extra document to learn whether another page exists
+        page = cursor.limit(limit + 1).to_list(length=limit + 1)
+        if not include_total:
+            # Clients paging on has_more skip the count query entirely
+            total_count, orders = None, await page
+        else:
+            total_count, orders = await asyncio.gather(
+                collections.orders.count_documents(filter_query, maxTimeMS=QUERY_MAX_TIME_MS),
+                page
+            )
         
-        return {
-            "orders": [serialize_doc(o) for o in orders],
+        has_more = len(orders) > limit
+        orders = orders[:limit]
+        
+        return conditional_response(request, dumps({
+            "orders": orders,
             "total": total_count,
             "limit": limit,
             "offset": offset,
+            "has_more": has_more,
+            "next_cursor": _encode_order_cursor(orders[-1]) if has_more else None,
             "user_id": user_id
-        }
+        }))
+    except HTTPException:
+        raise
+    except (ExecutionTimeout, WaitQueueTimeoutError):
+        raise HTTPException(status_code=503, detail="Query timed out, please retry")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools")
\ No newline at end of file
@@ -1,7 +1,38 @@
 # models.py
-from pydantic import BaseModel, Field, validator
+from functools import lru_cache
+from pydantic import BaseModel, Field
 from typing import List, Optional
 from bson import ObjectId
+from bson.errors import InvalidId
+from pydantic_core import core_schema
+
+# Hot ids (popular products, cursors) skip the hex decode on repeat hits;
+# bounded so arbitrary client input cannot grow it without limit
+_parse_object_id = lru_cache(maxsize=4096)(ObjectId)
+
+class PyObjectId(ObjectId):
+    """ObjectId field: validated once from its hex string, serialized back to str"""
+    
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source_type, handler):
+        return core_schema.no_info_plain_validator_function(
+            cls.validate,
+            serialization=core_schema.to_string_ser_schema()
+        )
+    
+    @classmethod
+    def __get_pydantic_json_schema__(cls, schema, handler):
+        return {"type": "string", "pattern": "^[0-9a-fA-F]{24}$"}
+    
+    @classmethod
+    def validate(cls, v):
+        if isinstance(v, ObjectId):
+            return v
+        # ObjectId() validates the hex itself; no separate pre-check
+        try:
+            return _parse_object_id(v)
+        except (InvalidId, TypeError):
+            raise ValueError('Invalid ObjectId')
 
 class CreateProductRequest(BaseModel):
     name: str = Field(..., min_length=1, max_length=200)
@@ -10,15 +41,9 @@ class CreateProductRequest(BaseModel):
     description: Optional[str] = None
 
 class OrderItem(BaseModel):
-    product_id: str
+    product_id: PyObjectId
     quantity: int = Field(..., gt=0, le=100)
-    
-    @validator('product_id')
-    def validate_product_id(cls, v):
-        if not ObjectId.is_valid(v):
-            raise ValueError('Invalid product ID')
-        return v
 
 class CreateOrderRequest(BaseModel):
     user_id: str = Field(..., min_length=1)
-    items: List[OrderItem] = Field(..., min_items=1, max_items=50)
\ No newline at end of file
+    items: List[OrderItem] = Field(..., min_length=1, max_length=50)
\ No newline at end of file
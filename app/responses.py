@@ -0,0 +1,41 @@
+# responses.py
+import hashlib
+import orjson
+from bson import ObjectId
+from fastapi.responses import ORJSONResponse, Response
+
+def _default(obj):
+    """orjson fallback for the BSON types stored documents carry"""
+    if type(obj) is ObjectId:
+        return str(obj)
+    raise TypeError
+
+def dumps(content):
+    """Encode documents straight from Motor, ObjectIds included, in one pass"""
+    return orjson.dumps(content, default=_default)
+
+class MongoJSONResponse(ORJSONResponse):
+    """ORJSONResponse that also encodes ObjectIds"""
+    
+    def render(self, content):
+        return dumps(content)
+
+def _etag_matches(if_none_match, etag):
+    """Weak If-None-Match comparison, '*' included"""
+    # Proxies that re-encode the body (nginx with gzip) hand the tag back
+    # weakened, as W/"..."
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+def conditional_response(request, body):
+    """JSON response tagged with an ETag; 304 when the client's copy matches"""
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)